@@ -1,10 +1,21 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import geopandas as gpd
+import pyarrow as pa
+from pyarrow import feather
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_squared_error, r2_score
 import sys
+import os
+import json
+import asyncio
+import urllib.parse
+from collections import OrderedDict
+import re
+import shutil
+import zipfile
 import warnings
 
 warnings.filterwarnings("ignore", message=".*GeoJSON does not support open option DRIVER.*")
@@ -18,27 +29,316 @@ except:
 
 #  CARGA DE DATOS
 
+# Columnas de la base individual que usa el análisis. Se proyectan al leer
+# para no mantener en memoria las ~180 columnas de la EPH.
+COLUMNAS_EPH = [
+    "CODUSU", "NRO_HOGAR", "COMPONENTE", "ANO4", "TRIMESTRE", "AGLOMERADO",
+    "ESTADO", "CH04", "CH06", "NIVEL_ED", "P47T", "PP04B_COD", "PP04D_COD",
+]
 
-def cargar_datos():
-    datos_dir = "Datos/"
-    df_total = pd.DataFrame()
+# Columnas de códigos/identificadores que se guardan como texto
+COLUMNAS_TEXTO = ["CODUSU", "PP04B_COD", "PP04D_COD"]
 
-    for anio in range(16, 26):  # carga 2016-2025
-        for trimestre in range(1, 5):
+DATOS_DIR = "Datos/"
+DATASET_DIR = "Datos/eph_particionado"
+# Firma del archivo fuente de cada partición (el lector de parquet ignora "_*")
+ARCHIVO_FIRMA = "_fuente.json"
 
-            if anio == 16 and trimestre == 1:
-                continue
-            elif anio == 25 and trimestre >= 3:
+PATRON_INDIVIDUAL = re.compile(r"usu_individual_T(\d)(\d\d)\.txt$", re.IGNORECASE)
+
+
+def indexar_zips(datos_dir="Datos/"):
+    """
+    Busca dentro de los .zip del INDEC los archivos usu_individual_T{t}{aa}.txt.
+    Devuelve {(trimestre, anio): (ruta_zip, miembro)} sin descomprimir nada.
+    """
+    indice = {}
+
+    if not os.path.isdir(datos_dir):
+        return indice
+
+    for nombre in sorted(os.listdir(datos_dir)):
+        if not nombre.lower().endswith(".zip"):
+            continue
+
+        ruta_zip = os.path.join(datos_dir, nombre)
+        try:
+            with zipfile.ZipFile(ruta_zip) as z:
+                miembros = z.namelist()
+        except zipfile.BadZipFile:
+            print(f"Archivo zip inválido: {nombre}")
+            continue
+
+        for miembro in miembros:
+            coincidencia = PATRON_INDIVIDUAL.search(miembro)
+            if coincidencia:
+                trimestre, anio = int(coincidencia.group(1)), int(coincidencia.group(2))
+                indice[(trimestre, anio)] = (ruta_zip, miembro)
+
+    return indice
+
+
+def leer_individual(fuente, miembro=None):
+    """
+    Lee una base individual proyectando COLUMNAS_EPH mientras se decodifica.
+    Si se indica 'miembro', 'fuente' es un zip y el archivo se lee como
+    stream desde el archivo comprimido, sin extraerlo a disco.
+    """
+    opciones = {
+        "sep": ";",
+        "encoding": "latin1",
+        "usecols": lambda columna: columna in COLUMNAS_EPH,
+    }
+
+    if miembro is None:
+        df_datos = pd.read_csv(fuente, **opciones)
+    else:
+        with zipfile.ZipFile(fuente) as z:
+            with z.open(miembro) as stream:
+                df_datos = pd.read_csv(stream, **opciones)
+
+    return completar_columnas(df_datos, miembro or fuente)
+
+
+def completar_columnas(df_datos, origen):
+    """
+    Deja el DataFrame con exactamente COLUMNAS_EPH, en ese orden. Las columnas
+    que falten se agregan vacías, tanto al leer el archivo crudo como al leer
+    la partición, para que ambos caminos den el mismo resultado.
+    """
+    faltantes = [c for c in COLUMNAS_EPH if c not in df_datos.columns]
+    if faltantes:
+        print(f"Aviso: {origen} no tiene las columnas {faltantes}; quedan vacías.")
+
+    return df_datos.reindex(columns=COLUMNAS_EPH)
+
+
+def normalizar_tipos(df_datos):
+    """
+    Unifica los tipos entre trimestres: los códigos quedan como texto y el
+    resto como numérico. Así todos los trimestres comparten el mismo esquema
+    en el dataset particionado.
+    """
+    for col in df_datos.columns:
+        if col in COLUMNAS_TEXTO:
+            serie = df_datos[col]
+            if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+                serie = serie.astype("Int64")
+            serie = serie.astype("string").str.strip()
+            serie = serie.mask(serie == "").astype(object)
+            df_datos[col] = serie.where(serie.notna(), None)
+        else:
+            df_datos[col] = pd.to_numeric(df_datos[col], errors="coerce")
+
+    return df_datos
+
+
+def ruta_particion(periodo, dataset_dir=DATASET_DIR):
+    """Directorio de la partición de un (ANO4, TRIMESTRE)"""
+    return os.path.join(dataset_dir, f"ANO4={periodo[0]}", f"TRIMESTRE={periodo[1]}")
+
+
+def firma_fuente(tipo, fuente):
+    """
+    Identifica el archivo crudo de un trimestre (ruta, fecha de modificación y
+    tamaño) junto con las columnas proyectadas. Si algo cambia, la partición
+    escrita a partir de él deja de ser válida.
+    """
+    ruta = fuente if tipo == "txt" else fuente[0]
+    info = os.stat(ruta)
+    return {
+        "fuente": ruta if tipo == "txt" else f"{fuente[0]}:{fuente[1]}",
+        "mtime": info.st_mtime,
+        "tamanio": info.st_size,
+        "columnas": COLUMNAS_EPH,
+    }
+
+
+def leer_firma(ruta):
+    """Devuelve la firma guardada en una partición, o None si no está completa"""
+    try:
+        with open(os.path.join(ruta, ARCHIVO_FIRMA), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def descubrir_periodos(datos_dir=DATOS_DIR, dataset_dir=DATASET_DIR):
+    """
+    Detecta qué trimestres hay disponibles, ya sea como .txt, dentro de un .zip
+    o como partición del dataset. Devuelve {(ANO4, TRIMESTRE): fuente}, donde
+    fuente es ("dataset", ruta), ("txt", ruta) o ("zip", (ruta_zip, miembro)).
+    """
+    periodos = {}
+
+    for (trimestre, anio), fuente in indexar_zips(datos_dir).items():
+        periodos[(2000 + anio, trimestre)] = ("zip", fuente)
+
+    if os.path.isdir(datos_dir):
+        for nombre in os.listdir(datos_dir):
+            coincidencia = PATRON_INDIVIDUAL.search(nombre)
+            if coincidencia:
+                trimestre, anio = int(coincidencia.group(1)), int(coincidencia.group(2))
+                periodos[(2000 + anio, trimestre)] = ("txt", os.path.join(datos_dir, nombre))
+
+    # Una partición se usa solo si se escribió completa y sigue correspondiendo
+    # al archivo crudo (y a las columnas) actuales; si no, se vuelve a generar.
+    if os.path.isdir(dataset_dir):
+        for dir_anio in os.listdir(dataset_dir):
+            if not dir_anio.startswith("ANO4="):
                 continue
+            ruta_anio = os.path.join(dataset_dir, dir_anio)
+            for dir_trim in os.listdir(ruta_anio):
+                if not dir_trim.startswith("TRIMESTRE="):
+                    continue
+                clave = (int(dir_anio.split("=")[1]), int(dir_trim.split("=")[1]))
+                ruta = os.path.join(ruta_anio, dir_trim)
+                firma = leer_firma(ruta)
+
+                if clave in periodos:
+                    if firma == firma_fuente(*periodos[clave]):
+                        periodos[clave] = ("dataset", ruta)
+                elif firma is not None and firma["columnas"] == COLUMNAS_EPH:
+                    periodos[clave] = ("dataset", ruta)
+                else:
+                    print(f"Partición {clave[0]}-T{clave[1]} incompleta o desactualizada "
+                          "y sin archivo fuente: se omite.")
 
-            archivo = datos_dir + f"usu_individual_T{trimestre}{anio}.txt"
+    return dict(sorted(periodos.items()))
 
-            try:
-                df_datos = pd.read_csv(archivo, sep=";", encoding="latin1")
-                df_total = pd.concat([df_total, df_datos])
-                print(f"{trimestre} Trimestre del año 20{anio} cargado.")
-            except:
-                pass
+
+def escribir_particion(df_datos, periodo, firma, dataset_dir=DATASET_DIR, por_aglomerado=False):
+    """
+    Escribe un trimestre en el dataset columnar particionado por año/trimestre
+    (y opcionalmente por aglomerado), con el layout ANO4=.../TRIMESTRE=.../
+    Reemplaza la partición anterior del trimestre y guarda la firma de la
+    fuente al final; si la escritura falla, no deja una partición a medias.
+    """
+    columnas = ["ANO4", "TRIMESTRE"]
+    if por_aglomerado:
+        columnas.append("AGLOMERADO")
+
+    ruta = ruta_particion(periodo, dataset_dir)
+    shutil.rmtree(ruta, ignore_errors=True)
+
+    try:
+        df_datos.to_parquet(dataset_dir, partition_cols=columnas, index=False)
+        with open(os.path.join(ruta, ARCHIVO_FIRMA), "w", encoding="utf-8") as f:
+            json.dump(firma, f)
+    except Exception:
+        shutil.rmtree(ruta, ignore_errors=True)
+        raise
+
+
+def leer_particion(ruta, periodo, aglomerados=None):
+    """
+    Lee una partición año/trimestre del dataset. El filtro de aglomerados se
+    empuja al lector, que descarta particiones o row groups sin leerlos.
+    """
+    filtros = None
+    if aglomerados is not None:
+        filtros = [("AGLOMERADO", "in", list(aglomerados))]
+
+    df_datos = pd.read_parquet(ruta, filters=filtros)
+
+    # Las columnas de partición vuelven como categóricas
+    if "AGLOMERADO" in df_datos.columns:
+        df_datos["AGLOMERADO"] = df_datos["AGLOMERADO"].astype(int)
+    df_datos["ANO4"] = periodo[0]
+    df_datos["TRIMESTRE"] = periodo[1]
+
+    return completar_columnas(df_datos, ruta)
+
+
+def codificar_identificadores(df_datos, diccionarios, memoria):
+    """
+    Reemplaza las columnas de COLUMNAS_TEXTO por códigos enteros (int32).
+    Los diccionarios se comparten entre trimestres: cada valor nuevo se
+    agrega al final, así los códigos ya asignados no cambian. Si el trimestre
+    no tiene la columna, todas sus filas quedan con el código -1 (faltante).
+    memoria[0] acumula los bytes originales para el reporte final.
+    """
+    for col in COLUMNAS_TEXTO:
+        if col not in df_datos.columns:
+            df_datos[col] = np.full(len(df_datos), -1, dtype="int32")
+            continue
+
+        serie = df_datos[col]
+        memoria[0] += serie.memory_usage(index=False, deep=True)
+
+        nuevos = pd.Index(serie.dropna().unique()).difference(diccionarios[col])
+        diccionarios[col] = diccionarios[col].append(nuevos)
+
+        df_datos[col] = diccionarios[col].get_indexer(serie).astype("int32")
+
+    return df_datos
+
+
+def finalizar_codificacion(df_total, diccionarios, memoria):
+    """Convierte los códigos en categóricas con el diccionario compartido"""
+    for col in COLUMNAS_TEXTO:
+        if col not in df_total.columns:
+            continue
+        df_total[col] = pd.Categorical.from_codes(df_total[col].to_numpy(), categories=diccionarios[col])
+
+    # Lo que realmente queda en memoria: códigos de la categórica + diccionario
+    despues = df_total[[c for c in COLUMNAS_TEXTO if c in df_total.columns]].memory_usage(
+        index=False, deep=True
+    ).sum()
+    antes, despues = memoria[0] / 1024**2, despues / 1024**2
+    print(f"Identificadores codificados ({', '.join(COLUMNAS_TEXTO)}): "
+          f"{antes:,.1f} MB -> {despues:,.1f} MB")
+
+    return df_total
+
+
+def cargar_datos(periodos=None, aglomerados=None, por_aglomerado=False):
+    """
+    Carga todos los trimestres disponibles en Datos/. Los que todavía no están
+    en el dataset particionado se leen del .txt/.zip y se escriben ahí, así las
+    cargas siguientes leen solo las particiones pedidas.
+    periodos: lista de (ANO4, TRIMESTRE) a cargar. None = todos.
+    aglomerados: lista de códigos de aglomerado a cargar. None = todos.
+    """
+    df_total = pd.DataFrame()
+    disponibles = descubrir_periodos()
+    diccionarios = {col: pd.Index([], dtype=object) for col in COLUMNAS_TEXTO}
+    memoria = [0]
+
+    for periodo, (tipo, fuente) in disponibles.items():
+
+        if periodos is not None and periodo not in periodos:
+            continue
+
+        ano4, trimestre = periodo
+
+        try:
+            if tipo == "dataset":
+                df_datos = leer_particion(fuente, periodo, aglomerados)
+            else:
+                if tipo == "txt":
+                    df_datos = leer_individual(fuente)
+                else:
+                    df_datos = leer_individual(*fuente)
+                df_datos = normalizar_tipos(df_datos)
+
+                try:
+                    escribir_particion(df_datos, periodo, firma_fuente(tipo, fuente),
+                                       por_aglomerado=por_aglomerado)
+                except Exception as e:
+                    print(f"No se pudo escribir la partición {ano4}-T{trimestre}:", e)
+
+                if aglomerados is not None:
+                    df_datos = df_datos[df_datos["AGLOMERADO"].isin(aglomerados)]
+
+            df_datos = codificar_identificadores(df_datos, diccionarios, memoria)
+            df_total = pd.concat([df_total, df_datos])
+            print(f"{trimestre} Trimestre del año {ano4} cargado.")
+        except Exception as e:
+            print(f"Error al cargar {ano4}-T{trimestre}:", e)
+
+    if len(df_total) > 0:
+        df_total = finalizar_codificacion(df_total, diccionarios, memoria)
 
     return df_total
 
@@ -53,16 +353,17 @@ def ajustar_por_inflacion(df_total):
         print("No se encontró ipc_trimestral.csv. Se usa ingreso nominal.")
         #Crear P47T_real aunque no haya archivo IPC
         df_total["P47T_real"] = pd.to_numeric(df_total["P47T"], errors="coerce")
+        df_total.attrs["periodo_base"] = None
         return df_total
 
     ipc["ANO4"] = ipc["ANO4"].astype(int)
     ipc["TRIMESTRE"] = ipc["TRIMESTRE"].astype(int)
 
-    base = ipc[(ipc["ANO4"] == 2024) & (ipc["TRIMESTRE"] == 4)]["IPC"].values
-    if len(base) == 0:
-        base = ipc["IPC"].iloc[-1]
-    else:
-        base = base[0]
+    fila_base = ipc[(ipc["ANO4"] == 2024) & (ipc["TRIMESTRE"] == 4)]
+    if len(fila_base) == 0:
+        fila_base = ipc.iloc[[-1]]
+    base = fila_base["IPC"].iloc[0]
+    periodo_base = f"{fila_base['ANO4'].iloc[0]}-T{fila_base['TRIMESTRE'].iloc[0]}"
 
     df_total["ANO4"] = pd.to_numeric(df_total["ANO4"], errors="coerce")
     df_total["TRIMESTRE"] = pd.to_numeric(df_total["TRIMESTRE"], errors="coerce")
@@ -73,9 +374,75 @@ def ajustar_por_inflacion(df_total):
 
     df_total["P47T_real"] = (df_total["P47T"] * (base / df_total["IPC"]))
 
+    # Período base del deflactor, para que quede registrado al exportar
+    df_total.attrs["periodo_base"] = periodo_base
+    df_total.attrs["ipc_base"] = float(base)
+
+    return df_total
+
+
+#  DEPURACIÓN DE INGRESOS (P47T_VALIDO)
+
+# Códigos de no respuesta de la EPH para montos de ingreso
+SENTINELAS_INGRESO = [-9]
+
+
+def depurar_ingresos(df_total, metodo="mad", umbral=None):
+    """
+    Marca una sola vez qué ingresos son utilizables, para que todos los
+    agregados y el modelo trabajen sobre las mismas filas:
+      P47T_NO_RESPUESTA: ingreso faltante o con código de no respuesta
+      P47T_ATIPICO:      atípico dentro de su período y aglomerado
+      P47T_VALIDO:       ingreso positivo, informado y no atípico
+    Los atípicos se detectan sobre log(ingreso), por grupo, con MAD
+    (z robusto > 3.5) o IQR (fuera de Q1/Q3 ± 1.5·IQR).
+    """
+    if umbral is None:
+        umbral = 3.5 if metodo == "mad" else 1.5
+
+    ingreso = pd.to_numeric(df_total["P47T"], errors="coerce")
+    df_total["P47T"] = ingreso
+
+    no_respuesta = ingreso.isna() | ingreso.isin(SENTINELAS_INGRESO)
+    positivo = ~no_respuesta & (ingreso > 0)
+    if "P47T_real" in df_total.columns:
+        positivo &= df_total["P47T_real"].notna()
+
+    log_ingreso = np.log(ingreso.where(positivo))
+    claves = [df_total[col].to_numpy() for col in ["ANO4", "TRIMESTRE", "AGLOMERADO"]]
+    grupos = log_ingreso.groupby(claves)
+
+    if metodo == "mad":
+        mediana = grupos.transform("median")
+        desvio = (log_ingreso - mediana).abs()
+        mad = desvio.groupby(claves).transform("median")
+        z = 0.6745 * desvio / mad.where(mad > 0)
+        atipico = z > umbral
+    elif metodo == "iqr":
+        q1 = grupos.transform("quantile", 0.25)
+        q3 = grupos.transform("quantile", 0.75)
+        rango = q3 - q1
+        atipico = (log_ingreso < q1 - umbral * rango) | (log_ingreso > q3 + umbral * rango)
+    else:
+        raise ValueError(f"Método de detección de atípicos desconocido: {metodo}")
+
+    df_total["P47T_NO_RESPUESTA"] = no_respuesta.to_numpy()
+    df_total["P47T_ATIPICO"] = atipico.to_numpy()
+    df_total["P47T_VALIDO"] = (positivo & ~atipico).to_numpy()
+
+    print(f"Ingresos: {int(no_respuesta.sum()):,} sin respuesta, "
+          f"{int(atipico.sum()):,} atípicos, {int(df_total['P47T_VALIDO'].sum()):,} válidos.")
+
     return df_total
 
 
+def ingresos_validos(df_total):
+    """Devuelve solo las filas con P47T_VALIDO (depura si aún no se hizo)"""
+    if "P47T_VALIDO" not in df_total.columns:
+        df_total = depurar_ingresos(df_total.copy())
+    return df_total[df_total["P47T_VALIDO"]]
+
+
 #  CÁLCULO DE TASAS (NUEVO)
 
 def calcular_tasas(df_total):
@@ -223,17 +590,17 @@ def grafico_tasa_desocupacion(df_total):
 
 #  FUNCIONES INDIVIDUALES PARA CADA GRÁFICO DE INGRESOS
 
-def mostrar_tabla_ingresos(df_total):
-    """Muestra solo la tabla de ingresos"""
+def calcular_ingresos(df_total):
+    """
+    Calcula la media y mediana del ingreso real por período y aglomerado
+    """
     df = df_total.copy()
     
     df = df[df["AGLOMERADO"].isin([18, 27])]
-    df["P47T_real"] = pd.to_numeric(df["P47T_real"], errors="coerce")
-    df = df[df["P47T_real"] > 0].dropna(subset=["P47T_real"])
+    df = ingresos_validos(df)
     
     if len(df) == 0:
-        print("No hay datos de ingresos disponibles")
-        return
+        return pd.DataFrame()
     
     df["PERIODO"] = df["ANO4"].astype(int).astype(str) + "-T" + df["TRIMESTRE"].astype(int).astype(str)
     
@@ -245,6 +612,17 @@ def mostrar_tabla_ingresos(df_total):
         ("Mediana", "median"),
     ]).reset_index()
     
+    return df_grouped
+
+
+def mostrar_tabla_ingresos(df_total):
+    """Muestra solo la tabla de ingresos"""
+    df_grouped = calcular_ingresos(df_total)
+    
+    if len(df_grouped) == 0:
+        print("No hay datos de ingresos disponibles")
+        return
+    
     print("\n" + "="*80)
     print(" EVOLUCIÓN DE INGRESOS REALES")
     print("="*80)
@@ -257,8 +635,7 @@ def grafico_ingreso_promedio(df_total):
     df = df_total.copy()
     
     df = df[df["AGLOMERADO"].isin([18, 27])]
-    df["P47T_real"] = pd.to_numeric(df["P47T_real"], errors="coerce")
-    df = df[df["P47T_real"] > 0].dropna(subset=["P47T_real"])
+    df = ingresos_validos(df)
     
     if len(df) == 0:
         print("No hay datos de ingresos disponibles")
@@ -288,8 +665,7 @@ def grafico_ingreso_mediano(df_total):
     df = df_total.copy()
     
     df = df[df["AGLOMERADO"].isin([18, 27])]
-    df["P47T_real"] = pd.to_numeric(df["P47T_real"], errors="coerce")
-    df = df[df["P47T_real"] > 0].dropna(subset=["P47T_real"])
+    df = ingresos_validos(df)
     
     if len(df) == 0:
         print("No hay datos de ingresos disponibles")
@@ -314,6 +690,197 @@ def grafico_ingreso_mediano(df_total):
     plt.show()
 
 
+#  DESESTACIONALIZACIÓN Y TENDENCIA (TODAS LAS SERIES A LA VEZ)
+
+# Media móvil centrada 2x4 (tendencia preliminar) y Henderson de 5 términos
+PESOS_2X4 = np.array([1, 2, 2, 2, 1]) / 8
+PESOS_HENDERSON_5 = np.array([-0.073, 0.294, 0.558, 0.294, -0.073])
+
+# Razón I/C que usa X-11 para los pesos de Musgrave del Henderson de 5 términos
+RAZON_IC_HENDERSON_5 = 0.001
+
+# Series que se ajustan en forma multiplicativa (en logaritmos)
+INDICADORES_MULTIPLICATIVOS = ["Ingreso_Media", "Ingreso_Mediana"]
+
+
+def pesos_musgrave(pesos, futuros, razon_ic):
+    """
+    Pesos asimétricos de Musgrave (los que usa X-11 en los extremos) para un
+    filtro simétrico cuando solo hay 'futuros' observaciones posteriores.
+    Devuelve los pesos de t-m ... t+futuros.
+    """
+    m = len(pesos) // 2
+    n = m + 1 + futuros
+    relacion = 4 / (np.pi * razon_ic ** 2)
+    centro = (n + 1) / 2
+
+    omitidos = pesos[n:]
+    j = np.arange(1, n + 1)
+    i = np.arange(n + 1, len(pesos) + 1)
+
+    correccion = (j - centro) * relacion / (1 + relacion * n * (n - 1) * (n + 1) / 12)
+    return pesos[:n] + omitidos.sum() / n + correccion * ((i - centro) * omitidos).sum()
+
+
+# Pesos de los extremos, indexados por la cantidad de observaciones futuras.
+# Para la 2x4 son promedios de 5 trimestres sobre el lado disponible: cada
+# trimestre del año suma 1/4 (no arrastran estacionalidad) y reproducen una
+# tendencia lineal sin desfase.
+EXTREMOS_2X4 = [
+    np.array([-0.375, 0.25, 0.25, 0.25, 0.625]),
+    np.array([-0.125, 0.25, 0.25, 0.25, 0.375]),
+]
+EXTREMOS_HENDERSON_5 = [
+    pesos_musgrave(PESOS_HENDERSON_5, futuros, RAZON_IC_HENDERSON_5) for futuros in range(2)
+]
+
+
+def _filtrar(matriz, pesos, extremos):
+    """
+    Aplica un filtro simétrico sobre el eje del tiempo a todas las filas.
+    En los primeros y últimos trimestres usa los pesos asimétricos de
+    'extremos' (extremos[d] = pesos con d observaciones futuras).
+    """
+    medio = len(pesos) // 2
+    largo = matriz.shape[1]
+    ventanas = np.lib.stride_tricks.sliding_window_view(matriz, len(pesos), axis=1)
+    resultado = np.full(matriz.shape, np.nan)
+    resultado[:, medio:largo - medio] = ventanas @ pesos
+
+    for futuros, asimetricos in enumerate(extremos):
+        pasados = len(asimetricos) - 1 - futuros
+        # Final de la serie: t = largo - 1 - futuros
+        t = largo - 1 - futuros
+        resultado[:, t] = matriz[:, t - pasados:t + futuros + 1] @ asimetricos
+        # Principio de la serie: el mismo filtro invertido
+        t = futuros
+        resultado[:, t] = matriz[:, t - futuros:t + pasados + 1] @ asimetricos[::-1]
+
+    return resultado
+
+
+def armar_panel_series(df_total):
+    """
+    Arma un panel trimestral: una fila por período (sin huecos) y una columna
+    por (aglomerado, indicador), para todos los aglomerados. Las tasas salen
+    de los conteos de ESTADO y los ingresos de las filas con P47T_VALIDO, en
+    una sola agregación por ANO4/TRIMESTRE/AGLOMERADO.
+    """
+    claves = ["ANO4", "TRIMESTRE", "AGLOMERADO"]
+    df = df_total[claves].apply(pd.to_numeric, errors="coerce")
+    estado = pd.to_numeric(df_total["ESTADO"], errors="coerce")
+
+    conteos = pd.DataFrame({
+        "Ocupados": estado.eq(1),
+        "Desocupados": estado.eq(2),
+        "Poblacion_Total": estado.notna(),
+    }).groupby([df[c] for c in claves]).sum()
+
+    pea = conteos["Ocupados"] + conteos["Desocupados"]
+    poblacion = conteos["Poblacion_Total"].where(conteos["Poblacion_Total"] > 0)
+    indicadores = pd.DataFrame({
+        "Tasa_Actividad": pea / poblacion * 100,
+        "Tasa_Empleo": conteos["Ocupados"] / poblacion * 100,
+        "Tasa_Desocupacion": (conteos["Desocupados"] / pea.where(pea > 0) * 100).fillna(0),
+    })
+
+    validos = ingresos_validos(df_total)
+    ingresos = validos["P47T_real"].groupby(
+        [pd.to_numeric(validos[c], errors="coerce") for c in claves]
+    ).agg(["mean", "median"])
+    ingresos.columns = ["Ingreso_Media", "Ingreso_Mediana"]
+
+    panel = indicadores.join(ingresos, how="outer")
+    panel = panel[panel.index.get_level_values("AGLOMERADO").notna()]
+    panel = panel.unstack("AGLOMERADO").swaplevel(axis=1).sort_index(axis=1)
+    panel.columns.names = ["AGLOMERADO", "INDICADOR"]
+
+    # Completar los trimestres faltantes para que el eje del tiempo sea regular
+    periodos = pd.PeriodIndex(
+        [pd.Period(year=int(a), quarter=int(t), freq="Q") for a, t in panel.index]
+    )
+    completo = pd.period_range(periodos.min(), periodos.max(), freq="Q")
+    panel.index = periodos
+    panel = panel.reindex(completo)
+    panel.index = [f"{p.year}-T{p.quarter}" for p in panel.index]
+    panel.index.name = "PERIODO"
+    panel.columns = panel.columns.set_levels(
+        panel.columns.levels[0].astype(int), level="AGLOMERADO"
+    )
+
+    return panel
+
+
+def desestacionalizar(panel):
+    """
+    Desestacionaliza todas las columnas del panel de una vez, tratándolas
+    como una matriz series x tiempo (descomposición clásica tipo X-11):
+      1. tendencia preliminar con media móvil 2x4
+      2. factor estacional = promedio por trimestre de (serie - tendencia)
+      3. serie desestacionalizada = serie - factor estacional
+      4. tendencia final con Henderson de 5 términos
+    En los dos primeros y dos últimos trimestres se usan pesos asimétricos
+    (promedios de un solo lado para la 2x4, Musgrave para el Henderson), así
+    la tendencia llega hasta el último trimestre. Los huecos internos de una
+    serie quedan sin tendencia en los trimestres vecinos.
+    Los ingresos se ajustan en logaritmos (modelo multiplicativo).
+    Devuelve un dict de DataFrames con la forma del panel: "original",
+    "estacional", "desestacionalizada" y "tendencia".
+    """
+    if len(panel) < len(PESOS_2X4):
+        raise ValueError("Se necesitan al menos 5 trimestres para desestacionalizar.")
+
+    multiplicativas = panel.columns.get_level_values("INDICADOR").isin(INDICADORES_MULTIPLICATIVOS)
+    trimestres = np.array([int(p.split("-T")[1]) for p in panel.index])
+
+    valores = panel.to_numpy(dtype=float).T
+    valores[multiplicativas] = np.log(valores[multiplicativas])
+
+    desvios = valores - _filtrar(valores, PESOS_2X4, EXTREMOS_2X4)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        factores = np.column_stack([
+            np.nanmean(desvios[:, trimestres == t], axis=1) for t in range(1, 5)
+        ])
+    factores -= np.nanmean(factores, axis=1, keepdims=True)
+    estacional = factores[:, trimestres - 1]
+
+    ajustada = valores - estacional
+    tendencia = _filtrar(ajustada, PESOS_HENDERSON_5, EXTREMOS_HENDERSON_5)
+
+    resultado = {}
+    for nombre, matriz in [("original", valores), ("estacional", estacional),
+                           ("desestacionalizada", ajustada), ("tendencia", tendencia)]:
+        matriz = matriz.copy()
+        matriz[multiplicativas] = np.exp(matriz[multiplicativas])
+        resultado[nombre] = pd.DataFrame(matriz.T, index=panel.index, columns=panel.columns)
+
+    return resultado
+
+
+def mostrar_series_desestacionalizadas(df_total):
+    """Muestra las series originales, desestacionalizadas y su tendencia"""
+    try:
+        series = desestacionalizar(armar_panel_series(df_total))
+    except (ValueError, KeyError) as e:
+        print("No hay datos suficientes para desestacionalizar:", e)
+        return
+
+    tabla = series["original"].melt(ignore_index=False, value_name="original")
+    for nombre in ["desestacionalizada", "tendencia"]:
+        tabla[nombre] = series[nombre].melt(ignore_index=False)["value"].to_numpy()
+
+    tabla = tabla.dropna(subset=["original"]).reset_index()
+    tabla = tabla.sort_values(["PERIODO", "AGLOMERADO", "INDICADOR"])
+
+    print("\n" + "="*80)
+    print(" SERIES DESESTACIONALIZADAS Y TENDENCIA")
+    print("="*80)
+    print(tabla.to_string(index=False, float_format=lambda x: f"{x:,.2f}"))
+    print("="*80)
+
+
 #  UNIVARIADO
 
 def analisar_univariado(df_total, variable):
@@ -382,11 +949,8 @@ def estadisticas_resumen(df_total):
         print("Verifique que se ejecutó ajustar_por_inflacion().")
         return
 
-    df["P47T_real"] = pd.to_numeric(df["P47T_real"], errors="coerce")
-    df = df.dropna(subset=["P47T_real"])
-    
-    # Filtrar ingresos positivos
-    df = df[df["P47T_real"] > 0]
+    # Ingresos válidos (sin no respuesta ni atípicos)
+    df = ingresos_validos(df)
 
     if len(df) == 0:
         print("No hay datos de ingresos disponibles.")
@@ -401,15 +965,20 @@ def estadisticas_resumen(df_total):
 
 #  MULTIVARIADO
 
-def analizar_multivariado(df_total, variable):
+MAPA_ESTADO = {
+    "Ocupados": 1,
+    "Desocupados": 2,
+    "Inactivo": 3,
+    "Menor de 10 años": 4
+}
 
-    # Mapas
-    mapa_estado = {
-        "Ocupados": 1,
-        "Desocupados": 2,
-        "Inactivo": 3,
-        "Menor de 10 años": 4
-    }
+
+def calcular_multivariado(df_total, variable):
+    """
+    Cuenta personas por período, aglomerado y sexo (para un ESTADO) o por
+    nivel educativo simple (variable = "Educacion").
+    Devuelve None si la variable no es válida.
+    """
 
     mapa_sexo = {1: "Masculino", 2: "Femenino"}
 
@@ -426,6 +995,14 @@ def analizar_multivariado(df_total, variable):
             return "Superior"
         return "NS/NR"
 
+    if variable not in MAPA_ESTADO and variable.lower() != "educacion":
+        return None
+
+    nombres_aglomerados = {
+        18: "Gran Mendoza",
+        27: "Comodoro Rivadavia"
+    }
+
     df = df_total.copy()
 
     for col in ["AGLOMERADO", "ANO4", "TRIMESTRE"]:
@@ -438,7 +1015,7 @@ def analizar_multivariado(df_total, variable):
     df["PERIODO"] = df["ANO4"].astype(int).astype(str) + "-T" + df["TRIMESTRE"].astype(int).astype(str)
 
     # ESTADO (con SEXO)
-    if variable in mapa_estado:
+    if variable in MAPA_ESTADO:
 
         df = df.copy()
         df["ESTADO"] = pd.to_numeric(df["ESTADO"], errors="coerce")
@@ -448,23 +1025,51 @@ def analizar_multivariado(df_total, variable):
         df["ESTADO"] = df["ESTADO"].astype(int)
         df["CH04"] = df["CH04"].astype(int)
 
-        df = df[df["ESTADO"] == mapa_estado[variable]]
+        df = df[df["ESTADO"] == MAPA_ESTADO[variable]]
         df["SEXO"] = df["CH04"].map(mapa_sexo)
 
         if len(df) == 0:
-            print(f"No hay datos suficientes para {variable}.")
-            return
+            return pd.DataFrame()
 
         df_grouped = df.groupby(["PERIODO", "AGLOMERADO", "SEXO"]).size().reset_index(name="TOTAL")
 
-        nombres_aglomerados = {
-            18: "Gran Mendoza",
-            27: "Comodoro Rivadavia"
-        }
-        
         df_grouped["AGLOMERADO_TXT"] = df_grouped["AGLOMERADO"].map(nombres_aglomerados)
         df_grouped["CATEGORIA"] = df_grouped["AGLOMERADO_TXT"] + "-" + df_grouped["SEXO"]
 
+        return df_grouped
+
+    # EDUCACIÓN SIMPLE
+
+    # Clasificar nivel educativo
+    df["NIVEL_SIMPLE"] = df["NIVEL_ED"].apply(clasificar_educacion)
+
+    df_grouped = df.groupby(
+        ["PERIODO", "AGLOMERADO", "NIVEL_SIMPLE"]
+    ).size().reset_index(name="TOTAL")
+
+    df_grouped["AGLOMERADO_TXT"] = df_grouped["AGLOMERADO"].map(nombres_aglomerados)
+
+    df_grouped["CATEGORIA"] = (
+        df_grouped["AGLOMERADO_TXT"] + " - " + df_grouped["NIVEL_SIMPLE"]
+    )
+
+    return df_grouped
+
+
+def analizar_multivariado(df_total, variable):
+
+    df_grouped = calcular_multivariado(df_total, variable)
+
+    if df_grouped is None:
+        return
+
+    # ESTADO (con SEXO)
+    if variable in MAPA_ESTADO:
+
+        if len(df_grouped) == 0:
+            print(f"No hay datos suficientes para {variable}.")
+            return
+
         pivot = df_grouped.pivot(index="PERIODO", columns="CATEGORIA", values="TOTAL").fillna(0)
 
         pivot.plot(kind="bar", figsize=(10, 6))  # Crear figura explícita
@@ -476,40 +1081,140 @@ def analizar_multivariado(df_total, variable):
         return
 
     # EDUCACIÓN SIMPLE
-    if variable.lower() == "educacion":
+    pivot = df_grouped.pivot(
+        index="PERIODO", 
+        columns="CATEGORIA", 
+        values="TOTAL"
+    ).fillna(0)
+
+    # Gráfico uniforme
+    pivot.plot(kind="bar", figsize=(8, 6))# Crear figura explícita
+    plt.title("Nivel Educativo — Comparación entre Aglomerados")
+    plt.xticks(rotation=45)
+    plt.legend(loc="upper left")
+    plt.tight_layout()
+    plt.show()
+    return
+
+
+#  API LOCAL (HTTP/JSON)
+
+# Cantidad máxima de respuestas guardadas en el cache de la API
+MAX_CACHE_API = 32
+
+
+def _clave_api(ruta, parametros):
+    """
+    Normaliza el pedido a la clave de cache: la ruta y solo los parámetros
+    que esa ruta usa. Devuelve (clave, None) o (None, (estado, JSON)) si el
+    pedido no es válido.
+    """
+    ruta = ruta.rstrip("/") or "/"
 
-        nombres_aglomerados = {
-            18: "Gran Mendoza",
-            27: "Comodoro Rivadavia"
+    if ruta in ("/", "/tasas", "/ingresos"):
+        return (ruta,), None
+
+    if ruta == "/multivariado":
+        variable = parametros.get("variable", [""])[0]
+        if variable in MAPA_ESTADO:
+            return (ruta, variable), None
+        if variable.lower() == "educacion":
+            return (ruta, "Educacion"), None
+        return None, (400, json.dumps({"error": f"Variable inválida: {variable}"}, ensure_ascii=False))
+
+    return None, (404, json.dumps({"error": f"Ruta no encontrada: {ruta}"}, ensure_ascii=False))
+
+
+def _agregado_json(df_total, clave):
+    """Calcula el agregado de una clave válida y lo devuelve como JSON"""
+    ruta = clave[0]
+
+    if ruta == "/":
+        indice = {
+            "endpoints": ["/tasas", "/ingresos", "/multivariado?variable=..."],
+            "variables_multivariado": list(MAPA_ESTADO) + ["Educacion"],
         }
+        return json.dumps(indice, ensure_ascii=False)
+
+    if ruta == "/tasas":
+        df_resultado = calcular_tasas(df_total)
+    elif ruta == "/ingresos":
+        df_resultado = calcular_ingresos(df_total)
+    else:
+        df_resultado = calcular_multivariado(df_total, clave[1])
 
-        # Clasificar nivel educativo
-        df["NIVEL_SIMPLE"] = df["NIVEL_ED"].apply(clasificar_educacion)
+    return df_resultado.to_json(orient="records", force_ascii=False)
 
-        df_grouped = df.groupby(
-            ["PERIODO", "AGLOMERADO", "NIVEL_SIMPLE"]
-        ).size().reset_index(name="TOTAL")
 
-        df_grouped["AGLOMERADO_TXT"] = df_grouped["AGLOMERADO"].map(nombres_aglomerados)
+async def _servir(df_total, host, puerto):
+    loop = asyncio.get_running_loop()
+    # clave -> future con el JSON, ordenado del uso más viejo al más nuevo.
+    # Los pedidos simultáneos de la misma clave esperan el mismo cálculo.
+    cache = OrderedDict()
+    estados = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
 
-        df_grouped["CATEGORIA"] = (
-            df_grouped["AGLOMERADO_TXT"] + " - " + df_grouped["NIVEL_SIMPLE"]
-        )
+    async def atender(reader, writer):
+        try:
+            linea = (await reader.readline()).decode("latin1").split()
+            # Descartar encabezados
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
 
-        pivot = df_grouped.pivot(
-            index="PERIODO", 
-            columns="CATEGORIA", 
-            values="TOTAL"
-        ).fillna(0)
+            if len(linea) < 2 or linea[0] != "GET":
+                estado, cuerpo = 405, json.dumps({"error": "Solo se admite GET"})
+            else:
+                url = urllib.parse.urlsplit(linea[1])
+                clave, error = _clave_api(url.path, urllib.parse.parse_qs(url.query))
 
-        # Gráfico uniforme
-        pivot.plot(kind="bar", figsize=(8, 6))# Crear figura explícita
-        plt.title("Nivel Educativo — Comparación entre Aglomerados")
-        plt.xticks(rotation=45)
-        plt.legend(loc="upper left")
-        plt.tight_layout()
-        plt.show()
-        return
+                if error is not None:
+                    estado, cuerpo = error
+                else:
+                    if clave in cache:
+                        cache.move_to_end(clave)
+                    else:
+                        cache[clave] = loop.run_in_executor(None, _agregado_json, df_total, clave)
+                        if len(cache) > MAX_CACHE_API:
+                            cache.popitem(last=False)
+                    futuro = cache[clave]
+                    try:
+                        estado, cuerpo = 200, await futuro
+                    except Exception as e:
+                        # No se guardan los errores: el próximo pedido reintenta
+                        if cache.get(clave) is futuro:
+                            del cache[clave]
+                        estado, cuerpo = 500, json.dumps({"error": str(e)}, ensure_ascii=False)
+
+            datos = cuerpo.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {estado} {estados[estado]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(datos)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin1") + datos
+            )
+            await writer.drain()
+        except Exception as e:
+            print("Error al atender pedido:", e)
+        finally:
+            writer.close()
+
+    servidor = await asyncio.start_server(atender, host, puerto)
+    print(f"API local en http://{host}:{puerto}/  (Ctrl+C para volver al menú)")
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def servir_api(df_total, host="127.0.0.1", puerto=8000):
+    """
+    Sirve tasas, ingresos y multivariado como JSON en localhost, con los
+    datos ya cargados en memoria y un cache de respuestas en memoria.
+    """
+    try:
+        asyncio.run(_servir(df_total, host, puerto))
+    except KeyboardInterrupt:
+        print("\nAPI detenida.")
+    except OSError as e:
+        print("No se pudo iniciar la API:", e)
 
 
 #  MODELO DE REGRESIÓN + IMPUTACIÓN (MEJORADO)
@@ -528,9 +1233,13 @@ def modelacion_regresion(df_total):
     df["PP04B_COD"] = pd.to_numeric(df["PP04B_COD"], errors="coerce")
     df["PP04D_COD"] = pd.to_numeric(df["PP04D_COD"], errors="coerce")
 
-    # Separar datos CON ingreso (para entrenar) y SIN ingreso (para imputar)
-    df_con_ingreso = df.dropna(subset=["P47T", "CH06", "NIVEL_ED", "CH04"])
-    df_sin_ingreso = df[df["P47T"].isna() & df["CH06"].notna() & df["NIVEL_ED"].notna() & df["CH04"].notna()]
+    if "P47T_VALIDO" not in df.columns:
+        df = depurar_ingresos(df)
+
+    # Separar datos CON ingreso válido (para entrenar) y SIN respuesta (para imputar)
+    completos = df["CH06"].notna() & df["NIVEL_ED"].notna() & df["CH04"].notna()
+    df_con_ingreso = df[df["P47T_VALIDO"] & completos]
+    df_sin_ingreso = df[df["P47T_NO_RESPUESTA"] & completos]
 
     if len(df_con_ingreso) == 0:
         print("No hay datos suficientes para entrenar el modelo")
@@ -636,6 +1345,59 @@ def mapa_aglomerados():
     plt.show()
 
 
+#  EXPORTACIÓN ARROW IPC / FEATHER
+
+def _escribir_feather(df, ruta, metadatos):
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    esquema = tabla.schema.metadata or {}
+    esquema.update({k.encode(): json.dumps(v, ensure_ascii=False).encode() for k, v in metadatos.items()})
+    # Sin compresión: los consumidores pueden mapear el archivo sin copiarlo
+    feather.write_feather(tabla.replace_schema_metadata(esquema), ruta, compression="uncompressed")
+
+
+def exportar_arrow(df_total, destino="Datos/export"):
+    """
+    Exporta los microdatos deflactados y las tablas agregadas como archivos
+    Arrow IPC (Feather v2) sin comprimir, con el período base del IPC
+    guardado en los metadatos del esquema.
+    """
+    os.makedirs(destino, exist_ok=True)
+
+    metadatos = {
+        "periodo_base": df_total.attrs.get("periodo_base"),
+        "ipc_base": df_total.attrs.get("ipc_base"),
+        "deflactor": "P47T_real = P47T * IPC_base / IPC",
+    }
+
+    tablas = {
+        "microdatos": df_total,
+        "tasas": calcular_tasas(df_total),
+        "ingresos": calcular_ingresos(df_total),
+    }
+    for variable in list(MAPA_ESTADO) + ["Educacion"]:
+        nombre = "multivariado_" + variable.lower().replace(" ", "_")
+        tablas[nombre] = calcular_multivariado(df_total, variable)
+
+    for nombre, df in tablas.items():
+        ruta = os.path.join(destino, f"{nombre}.feather")
+        _escribir_feather(df, ruta, {**metadatos, "tabla": nombre})
+        print(f"Exportado: {ruta} ({len(df):,} filas)")
+
+
+def leer_arrow(ruta):
+    """
+    Abre un archivo exportado por exportar_arrow mapeándolo en memoria.
+    Devuelve la pyarrow.Table (sin copias) y sus metadatos.
+    """
+    tabla = pa.ipc.open_file(pa.memory_map(ruta, "r")).read_all()
+    metadatos = {
+        k.decode(): json.loads(v)
+        for k, v in (tabla.schema.metadata or {}).items()
+        if k != b"pandas"
+    }
+    return tabla, metadatos
+
+
 #  MENÚ MEJORADO
 
 def menu(df_total):
@@ -655,6 +1417,9 @@ def menu(df_total):
         "7) Mapa georreferenciado\n"
         "\n--- UTILIDADES ---\n"
         "\n8) Volver a cargar datos\n"
+        "9) Servir API local (JSON)\n"
+        "10) Exportar datos y tablas (Arrow/Feather)\n"
+        "11) Series desestacionalizadas y tendencia\n"
         "0) Salir")
         print("="*70)
 
@@ -774,6 +1539,19 @@ def menu(df_total):
             print("\nRecargando datos...")
             df_total = cargar_datos()
             df_total = ajustar_por_inflacion(df_total)
+            df_total = depurar_ingresos(df_total)
+
+        # OPCIÓN 9: API LOCAL
+        elif opcion == "9":
+            servir_api(df_total)
+
+        # OPCIÓN 10: EXPORTAR ARROW
+        elif opcion == "10":
+            exportar_arrow(df_total)
+
+        # OPCIÓN 11: DESESTACIONALIZACIÓN
+        elif opcion == "11":
+            mostrar_series_desestacionalizadas(df_total)
 
         # OPCIÓN 0: SALIR
         elif opcion == "0":
@@ -795,6 +1573,7 @@ if __name__ == "__main__":
     
     df = cargar_datos()
     df = ajustar_por_inflacion(df)
+    df = depurar_ingresos(df)
     
     print("\n Datos cargados correctamente")
     print(f"  Total de registros: {len(df):,}")